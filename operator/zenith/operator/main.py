@@ -36,6 +36,11 @@ from pydantic.json import pydantic_encoder
 ekclient = Configuration.from_environment(json_encoder = pydantic_encoder).async_client()
 
 
+# Create a client for the Zenith registrar that is shared by all handlers
+# This allows connections to the registrar to be reused between reservations
+zclient = httpx.AsyncClient(base_url = settings.registrar_admin_url)
+
+
 # Create a registry of custom resources and populate it from the models module
 registry = CustomResourceRegistry(settings.api_group, settings.crd_categories)
 registry.discover_models(models)
@@ -91,6 +96,7 @@ async def on_cleanup(**kwargs):
     Runs on operator shutdown.
     """
     await ekclient.aclose()
+    await zclient.aclose()
 
 
 async def ekresource_for_model(model, subresource = None):
@@ -213,13 +219,9 @@ async def reservation_changed(instance, name, namespace, body, **kwargs):
         raise kopf.TemporaryError("unable to find public key data in secret")
     else:
         public_key = base64.b64decode(public_key_b64).decode()
-    async with httpx.AsyncClient(base_url = settings.registrar_admin_url) as zclient:
-        response = await zclient.post(
-            "/admin/reserve",
-            json = { "public_keys": [public_key] }
-        )
-        response.raise_for_status()
-        response_data = response.json()
+    response = await zclient.post("/admin/reserve", json = { "public_keys": [public_key] })
+    response.raise_for_status()
+    response_data = response.json()
     # Patch the status to reflect the reserved subdomain
     instance.status.phase = api.ReservationPhase.READY
     instance.status.subdomain = response_data["subdomain"]
@@ -294,10 +296,8 @@ async def client_changed(instance, name, namespace, body, **kwargs):
     except KeyError:
         raise kopf.TemporaryError("unable to find private key data in reservation secret")
     # Derive the upstream host from the service
-    upstream_host = "{}.{}.{}".format(
-        service.metadata.name,
-        service.metadata.namespace,
-        settings.cluster_service_domain
+    upstream_host = (
+        f"{service.metadata.name}.{service.metadata.namespace}.{settings.cluster_service_domain}"
     )
     # Derive the upstream port based on the specified port
     if instance.spec.upstream.port:
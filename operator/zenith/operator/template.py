@@ -2,6 +2,12 @@ import jinja2
 import json
 import yaml
 
+# Use the LibYAML-based loader and dumper when they are available, as they are much faster
+try:
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
 from pydantic.json import pydantic_encoder
 
 from .config import settings
@@ -14,7 +20,14 @@ def toyaml(obj):
     """
     # In order to benefit from the Pydantic encoder we need to go via JSON
     obj_json = json.dumps(obj, default = pydantic_encoder)
-    return yaml.safe_dump(json.loads(obj_json))
+    return yaml.dump(json.loads(obj_json), Dumper = SafeDumper)
+
+
+def fromyaml(data):
+    """
+    Filter for loading an object from YAML.
+    """
+    return yaml.load(data, Loader = SafeLoader)
 
 
 class Loader:
@@ -28,7 +41,7 @@ class Loader:
         self.env.globals.update(globals)
         self.env.filters.update(
             mergeconcat = utils.mergeconcat,
-            fromyaml = yaml.safe_load,
+            fromyaml = fromyaml,
             toyaml = toyaml
         )
 
@@ -43,7 +56,7 @@ class Loader:
         Render the specified template with the given params, load the result as a YAML document
         and return the resulting object.
         """
-        return yaml.safe_load(self.loads(template, **params))
+        return fromyaml(self.loads(template, **params))
 
 
 default_loader = Loader(settings = settings, models = models)
@@ -0,0 +1,121 @@
+import argparse
+import hashlib
+import os
+import struct
+import time
+import typing
+
+import requests
+
+from .config import SSHDConfig, load_config
+
+
+#: The name of the negative cache file in the SSHD run directory
+NEGATIVE_CACHE_FILE = "rejected-keys.cache"
+#: The number of slots in the negative cache
+NEGATIVE_CACHE_SLOTS = 65536
+#: Each slot contains a fingerprint of the key and the time at which the entry expires
+NEGATIVE_CACHE_ENTRY = struct.Struct("=8sd")
+
+
+def _negative_cache_slot(public_key: str) -> typing.Tuple[int, bytes]:
+    """
+    Returns the offset of the slot in the negative cache and the fingerprint for the given key.
+    """
+    digest = hashlib.blake2s(public_key.encode(), digest_size = 16).digest()
+    slot = int.from_bytes(digest[:8], "little") % NEGATIVE_CACHE_SLOTS
+    return slot * NEGATIVE_CACHE_ENTRY.size, digest[8:]
+
+
+def is_recently_rejected(cache_path: str, public_key: str) -> bool:
+    """
+    Returns true if the given key was rejected by the registrar within the cache TTL.
+
+    The cache is a fixed-size file of slots that is shared by all authorized keys commands.
+    A key that maps to the same slot as another key evicts it, so the worst case is an
+    additional request to the registrar.
+    """
+    offset, fingerprint = _negative_cache_slot(public_key)
+    # Any problem reading the cache just means that the registrar is asked
+    try:
+        fd = os.open(cache_path, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        data = os.pread(fd, NEGATIVE_CACHE_ENTRY.size, offset)
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+    # A short read means that the slot has never been written
+    if len(data) < NEGATIVE_CACHE_ENTRY.size:
+        return False
+    cached_fingerprint, expires = NEGATIVE_CACHE_ENTRY.unpack(data)
+    return cached_fingerprint == fingerprint and expires > time.time()
+
+
+def record_rejected(cache_path: str, public_key: str, ttl: int):
+    """
+    Records that the given key was rejected by the registrar.
+    """
+    offset, fingerprint = _negative_cache_slot(public_key)
+    entry = NEGATIVE_CACHE_ENTRY.pack(fingerprint, time.time() + ttl)
+    # Failing to record the rejection only means that the registrar is asked again
+    try:
+        fd = os.open(cache_path, os.O_WRONLY | os.O_CREAT, 0o600)
+    except OSError:
+        return
+    try:
+        os.pwrite(fd, entry, offset)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def authorized_keys_line(
+    config: SSHDConfig,
+    key_type: str,
+    key_content: str
+) -> typing.Optional[str]:
+    """
+    Returns the authorized keys line for the given public key, or None if the key is not
+    permitted to connect.
+    """
+    public_key = f"{key_type} {key_content}"
+    cache_ttl = config.authorized_keys_negative_cache_ttl
+    cache_path = os.path.join(config.run_directory, NEGATIVE_CACHE_FILE)
+    if cache_ttl and is_recently_rejected(cache_path, public_key):
+        return None
+    # Make a request to the registrar service to check the SSH public key
+    url = config.registrar_url + "/admin/verify"
+    response = requests.post(url, json = { "public_key": public_key })
+    # The expected error codes are 404 or 409, in which case the key is not permitted
+    #   404 indicates the key is not associated with a subdomain
+    #   409 indicates that the key is associated with multiple subdomains, and we refuse to pick
+    if response.status_code in {404, 409}:
+        if cache_ttl:
+            record_rejected(cache_path, public_key, cache_ttl)
+        return None
+    # Any other status codes should be a command error
+    response.raise_for_status()
+    # On success we permit the key, but restrict the command to the associated subdomain
+    subdomain = response.json()["subdomain"]
+    return f"command=\"zenith-sshd tunnel {subdomain}\" {key_type} {key_content}"
+
+
+def main():
+    """
+    Authorized keys command for Zenith SSHD instances.
+
+    This is run by SSHD for every connection attempt, so it is a separate entrypoint that
+    avoids the overhead of Click and the setup for the other zenith-sshd commands.
+    """
+    parser = argparse.ArgumentParser(description = "Authorized keys command for Zenith SSHD.")
+    parser.add_argument("--config", help = "Path to configuration file")
+    parser.add_argument("key_type")
+    parser.add_argument("key_content")
+    args = parser.parse_args()
+    line = authorized_keys_line(load_config(args.config), args.key_type, args.key_content)
+    if line:
+        print(line)
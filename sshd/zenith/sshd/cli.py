@@ -1,106 +1,53 @@
-import logging
-import os
-import pathlib
-import subprocess
+import importlib
+import typing
 
 import click
-import requests
 
-from .config import SSHDConfig
-from .tunnel import run as run_tunnel
 
-
-@click.group()
-@click.option("--config", type = click.Path(exists = True), help = "Path to configuration file")
-@click.pass_context
-def main(ctx, config):
+class LazyGroup(click.Group):
     """
-    Zenith SSHD utilities.
+    Click group that only imports the module for a command when the command is used.
     """
-    ctx.ensure_object(dict)
-    ctx.obj["CONFIG"] = SSHDConfig(_path = config)
-    ctx.obj["CONFIG"].logging.apply()
-    ctx.obj["LOGGER"] = logging.getLogger(__name__)
+    def __init__(self, *args, lazy_commands: typing.Dict[str, str], **kwargs):
+        super().__init__(*args, **kwargs)
+        # Map of command name to "module:attribute" for the command
+        self.lazy_commands = lazy_commands
 
+    def list_commands(self, ctx):
+        return sorted([*super().list_commands(ctx), *self.lazy_commands])
 
-@main.command()
-@click.pass_context
-@click.argument("key_type")
-@click.argument("key_content")
-def authorized_keys(ctx, key_type, key_content):
-    """
-    Authorized keys command for Zenith SSHD instances.
-    """
-    # Make a request to the registrar service to check the SSH public key
-    url = ctx.obj["CONFIG"].registrar_url + "/admin/verify"
-    response = requests.post(url, json = { "public_key": f"{key_type} {key_content}" })
-    # The expected error codes are 404 or 409, in which case we exit without printing anything
-    #   404 indicates the key is not associated with a subdomain
-    #   409 indicates that the key is associated with multiple subdomains, and we refuse to pick
-    if response.status_code in {404, 409}:
-        return
-    # Any other status codes should be a command error
-    response.raise_for_status()
-    # On success we permit the key, but restrict the command to the associated subdomain
-    subdomain = response.json()["subdomain"]
-    print(f"command=\"zenith-sshd tunnel {subdomain}\" {key_type} {key_content}")
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_commands:
+            module_name, command_name = self.lazy_commands[cmd_name].split(":")
+            module = importlib.import_module(module_name, __package__)
+            return getattr(module, command_name)
+        else:
+            return super().get_command(ctx, cmd_name)
 
 
-# The hostkeys to create, along with the number of bytes
-HOSTKEYS = [
-    ("dsa",     None),
-    ("rsa",     4096),
-    ("ecdsa",   521),
-    ("ed25519", None)
-]
+# The commands that do not require logging to be configured
+SKIP_LOGGING = {"authorized-keys"}
 
 
-@main.command()
-@click.pass_context
-def ensure_hostkeys(ctx):
-    """
-    Ensure that the required SSHD hostkeys exist.
-    """
-    ctx.obj["LOGGER"].info("Ensuring host keys exist")
-    # Generate unique hostkeys in the SSHD run directory if not present
-    run_directory = pathlib.Path(ctx.obj["CONFIG"].run_directory)
-    for key_type, key_bits in HOSTKEYS:
-        key_file = run_directory / f"ssh_host_{key_type}_key"
-        if not key_file.exists():
-            ctx.obj["LOGGER"].info(f"Generating {key_type} host key at {key_file}")
-            keygen_args = ["ssh-keygen", "-q", "-N", "", "-t", key_type, "-f", str(key_file)]
-            if key_bits:
-                keygen_args.extend(["-b", str(key_bits)])
-            subprocess.check_call(keygen_args)
-
-
-@main.command()
-@click.pass_context
-def start(ctx):
-    """
-    Configure and start a Zenith SSHD server.
-    """
-    # Ensure the hostkeys are present
-    ctx.forward(ensure_hostkeys)
-    ctx.obj["LOGGER"].info("Collecting forwarded environment variables")
-    # Ensure all environment variables starting ZENITH_SSHD are forwarded by SSHD
-    # Also ensure that the host and port for the Kubernetes API server are available to tunnels
-    forward_env = " ".join(
-        f"{name}=\"{value}\""
-        for name, value in os.environ.items()
-        if name.startswith("ZENITH_SSHD_") or name.startswith("KUBERNETES_SERVICE_")
-    )
-    ctx.obj["LOGGER"].info("Starting SSHD")
-    # Run SSHD by replacing the current process
-    sshd_executable = ctx.obj["CONFIG"].sshd_executable
-    os.execl(sshd_executable, sshd_executable, "-D", "-e", "-o", f"SetEnv={forward_env}")
-
-
-@main.command()
+@click.group(
+    cls = LazyGroup,
+    lazy_commands = {
+        "authorized-keys": ".commands.authorized_keys:authorized_keys",
+        "ensure-hostkeys": ".commands.ensure_hostkeys:ensure_hostkeys",
+        "start": ".commands.start:start",
+        "tunnel": ".commands.tunnel:tunnel",
+    }
+)
+@click.option("--config", type = click.Path(exists = True), help = "Path to configuration file")
 @click.pass_context
-@click.argument("subdomain")
-def tunnel(ctx, subdomain):
+def main(ctx, config):
     """
-    Configures a Zenith tunnel for a connecting client for the given subdomain.
+    Zenith SSHD utilities.
     """
-    run_tunnel(ctx.obj["CONFIG"], subdomain)
+    from .config import load_config
+    ctx.ensure_object(dict)
+    ctx.obj["CONFIG"] = load_config(config)
+    # The authorized keys command is run by SSHD for every connection attempt and never logs,
+    # so we skip setting up the log handlers for it
+    if ctx.invoked_subcommand not in SKIP_LOGGING:
+        ctx.obj["CONFIG"].logging.apply()
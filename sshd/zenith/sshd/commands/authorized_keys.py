@@ -0,0 +1,16 @@
+import click
+
+from ..authorized_keys import authorized_keys_line
+
+
+@click.command()
+@click.pass_context
+@click.argument("key_type")
+@click.argument("key_content")
+def authorized_keys(ctx, key_type, key_content):
+    """
+    Authorized keys command for Zenith SSHD instances.
+    """
+    line = authorized_keys_line(ctx.obj["CONFIG"], key_type, key_content)
+    if line:
+        print(line)
@@ -0,0 +1,86 @@
+import functools
+import logging
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+
+logger = logging.getLogger(__name__)
+
+
+# The hostkeys to create, along with the number of bytes
+# We cannot use a single "ssh-keygen -A" for these, as it uses the default sizes for
+# RSA and ECDSA keys and does not generate DSA keys
+HOSTKEYS = [
+    ("dsa",     None),
+    ("rsa",     4096),
+    ("ecdsa",   521),
+    ("ed25519", None)
+]
+# The key type, file name and ssh-keygen arguments (minus the output file) for each hostkey
+HOSTKEY_ARGV = tuple(
+    (
+        key_type,
+        f"ssh_host_{key_type}_key",
+        ("ssh-keygen", "-q", "-N", "", "-t", key_type, *(("-b", str(key_bits)) if key_bits else ()))
+    )
+    for key_type, key_bits in HOSTKEYS
+)
+# The file that indicates all the hostkeys exist
+HOSTKEYS_SENTINEL = ".hostkeys_ready"
+
+
+@functools.lru_cache(maxsize = 1)
+def _hostkey_commands(run_directory: str):
+    """
+    Returns the key type, key file and full ssh-keygen command for each hostkey
+    in the given run directory.
+    """
+    return tuple(
+        (key_type, f"{run_directory}/{key_name}", (*keygen_args, "-f", f"{run_directory}/{key_name}"))
+        for key_type, key_name, keygen_args in HOSTKEY_ARGV
+    )
+
+
+def _run_keygen(keygen_args):
+    """
+    Runs ssh-keygen with the given arguments, raising CalledProcessError on failure.
+
+    posix_spawn is used instead of subprocess to avoid the cost of forking the Python process.
+    """
+    pid = os.posix_spawnp(keygen_args[0], keygen_args, os.environ)
+    _, status = os.waitpid(pid, 0)
+    returncode = os.waitstatus_to_exitcode(status)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, keygen_args)
+
+
+@click.command()
+@click.pass_context
+def ensure_hostkeys(ctx):
+    """
+    Ensure that the required SSHD hostkeys exist.
+    """
+    logger.info("Ensuring host keys exist")
+    # Plain strings are sufficient for the paths as they are only passed to ssh-keygen
+    run_directory = os.fspath(ctx.obj["CONFIG"].run_directory)
+    # Once all the keys have been generated, a sentinel file is written
+    # On subsequent starts, this allows us to skip checking for each key individually
+    sentinel = f"{run_directory}/{HOSTKEYS_SENTINEL}"
+    if os.path.lexists(sentinel):
+        return
+    # Generate unique hostkeys in the SSHD run directory if not present
+    # The keys are independent, so we generate them concurrently
+    # Threads are sufficient as the GIL is released while waiting for ssh-keygen
+    with ThreadPoolExecutor(max_workers = len(HOSTKEYS)) as executor:
+        futures = []
+        for key_type, key_file, keygen_args in _hostkey_commands(run_directory):
+            if not os.path.lexists(key_file):
+                logger.info("Generating %s host key at %s", key_type, key_file)
+                futures.append(executor.submit(_run_keygen, keygen_args))
+        # Propagate any errors from ssh-keygen
+        for future in futures:
+            future.result()
+    open(sentinel, "w").close()
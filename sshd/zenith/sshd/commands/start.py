@@ -0,0 +1,51 @@
+import logging
+import os
+import shlex
+
+import click
+
+from .ensure_hostkeys import ensure_hostkeys
+
+
+logger = logging.getLogger(__name__)
+
+
+# The prefixes of the environment variables that are forwarded to tunnels
+# These are bytes so that the raw environment can be filtered without decoding it
+FORWARD_ENV_PREFIXES = (b"ZENITH_SSHD_", b"KUBERNETES_SERVICE_")
+
+
+# The fixed arguments for SSHD, which are followed by the SetEnv option
+SSHD_ARGV_HEAD = ("-D", "-e", "-o")
+
+
+def _build_setenv():
+    """
+    Returns the value for the SSHD SetEnv option that forwards the required environment.
+    """
+    # Ensure all environment variables starting ZENITH_SSHD are forwarded by SSHD
+    # Also ensure that the host and port for the Kubernetes API server are available to tunnels
+    # The values are quoted so that values containing spaces or quotes survive SSHD parsing
+    # Only the matching variables are decoded
+    return " ".join(
+        f"{os.fsdecode(name)}={shlex.quote(os.fsdecode(value))}"
+        for name, value in os.environb.items()
+        if name.startswith(FORWARD_ENV_PREFIXES)
+    )
+
+
+@click.command()
+@click.pass_context
+def start(ctx):
+    """
+    Configure and start a Zenith SSHD server.
+    """
+    # Ensure the hostkeys are present
+    ctx.forward(ensure_hostkeys)
+    logger.info("Collecting forwarded environment variables")
+    forward_env = _build_setenv()
+    logger.info("Starting SSHD")
+    # Run SSHD by replacing the current process
+    sshd_executable = os.fspath(ctx.obj["CONFIG"].sshd_executable)
+    sshd_argv = [sshd_executable, *SSHD_ARGV_HEAD, "SetEnv=" + forward_env]
+    os.execve(sshd_executable, sshd_argv, os.environ)
@@ -0,0 +1,13 @@
+import click
+
+from ..tunnel import run as run_tunnel
+
+
+@click.command()
+@click.pass_context
+@click.argument("subdomain")
+def tunnel(ctx, subdomain):
+    """
+    Configures a Zenith tunnel for a connecting client for the given subdomain.
+    """
+    run_tunnel(ctx.obj["CONFIG"], subdomain)
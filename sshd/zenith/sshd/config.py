@@ -1,10 +1,25 @@
+import hashlib
+import os
+import pickle
 import socket
+import tempfile
 
 from pydantic import DirectoryPath, FilePath, Field, conint, constr
 
 from configomatic import Configuration, LoggingConfiguration
 
 
+#: The default location of the configuration file
+DEFAULT_PATH = "/etc/zenith/sshd.yaml"
+#: The environment variable that can be used to specify the location of the configuration file
+PATH_ENV_VAR = "ZENITH_SSHD_CONFIG"
+#: The prefix for environment variables that override configuration options
+ENV_PREFIX = "ZENITH_SSHD"
+
+#: The directory containing the on-disk cache of parsed configurations
+CACHE_DIRECTORY = "/var/run/sshd"
+
+
 def default_service_host():
     """
     Returns the default service host.
@@ -15,9 +30,9 @@ def default_service_host():
 
 class SSHDConfig(
     Configuration,
-    default_path = "/etc/zenith/sshd.yaml",
-    path_env_var = "ZENITH_SSHD_CONFIG",
-    env_prefix = "ZENITH_SSHD"
+    default_path = DEFAULT_PATH,
+    path_env_var = PATH_ENV_VAR,
+    env_prefix = ENV_PREFIX
 ):
     """
     Configuration model for the zenith-sshd package.
@@ -59,6 +74,10 @@ class SSHDConfig(
 
     #: The URL of the Zenith registrar service
     registrar_url: str
+    #: The number of seconds for which keys rejected by the registrar are remembered, so that
+    #: repeated connection attempts with the same key do not each query the registrar
+    #: A value of zero disables the cache
+    authorized_keys_negative_cache_ttl: conint(ge = 0) = 0
 
     #: The SSHD executable location
     sshd_executable: FilePath = "/usr/sbin/sshd"
@@ -71,3 +90,63 @@ class SSHDConfig(
         The URL to use to access Consul.
         """
         return f"http://{self.consul_address}:{self.consul_port}"
+
+
+def _cache_key(path):
+    """
+    Returns the key that a cached configuration must match in order to be used.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        file_key = None
+    else:
+        file_key = (stat.st_mtime_ns, stat.st_size)
+    environ = tuple(sorted(
+        (name, value)
+        for name, value in os.environ.items()
+        if name.startswith(ENV_PREFIX)
+    ))
+    return (path, file_key, environ)
+
+
+def load_config(path = None) -> SSHDConfig:
+    """
+    Loads the configuration from the given path, or the default path if not given.
+
+    Because some commands are run by SSHD for every connection, the parsed configuration
+    is cached in the SSHD run directory and reused until the configuration file or the
+    ZENITH_SSHD_* environment variables change. Each distinct key gets its own cache file,
+    as the commands run by SSHD do not all see the same environment, e.g. the authorized
+    keys command is run with a minimal environment. Changes to included files are not
+    detected, but the run directory does not outlive the pod that the configuration is
+    mounted into.
+    """
+    key = _cache_key(path or os.environ.get(PATH_ENV_VAR, DEFAULT_PATH))
+    cache_path = os.path.join(
+        CACHE_DIRECTORY,
+        "config-{}.cache".format(hashlib.sha256(repr(key).encode()).hexdigest())
+    )
+    # If there is a cached configuration for the same key, use it
+    # Any problem reading the cache just results in the configuration being parsed
+    try:
+        with open(cache_path, "rb") as fh:
+            cached_key, cached_config = pickle.load(fh)
+    except Exception:
+        pass
+    else:
+        if cached_key == key:
+            return cached_config
+    config = SSHDConfig(_path = path)
+    # Write the cache atomically so that concurrent commands never see a partial file
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir = CACHE_DIRECTORY)
+    except OSError:
+        return config
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            pickle.dump((key, config), fh)
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        os.unlink(tmp_path)
+    return config
@@ -1,6 +1,5 @@
-import asyncio
-
 import click
+import uvloop
 
 from .config import SyncConfig
 from .main import run
@@ -14,4 +13,4 @@ def main(config):
     """
     config = SyncConfig(_path = config)
     config.logging.apply()
-    asyncio.run(run(config))
+    uvloop.run(run(config))
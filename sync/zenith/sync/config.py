@@ -222,6 +222,9 @@ class KubernetesConfig(Section):
     service_name_label: str = "zenith.stackhpc.com/service-name"
     #: The annotation used to record that a resource is a mirror of another
     mirror_annotation: str = "zenith.stackhpc.com/mirrors"
+    #: The interval over which bursts of changes to a mirrored object are coalesced
+    #: Only the most recent change in each burst is applied to the mirror
+    mirror_coalesce_interval: t.Annotated[float, Field(ge = 0)] = 0.1
     #: The maximum number of concurrent reconciliations
     reconciliation_max_concurrency: t.Annotated[int, Field(gt = 0)] = 20
     #: The maximum delay between retries when backing off
@@ -129,12 +129,15 @@ class EventQueue:
         # CancelledError, allowing the processor as a whole to be cancelled reliably
         if not any(e.service.name == event.service.name for e, _ in self._queue):
             # Calculate the backoff to use
-            backoff = 2**retries + random.uniform(0, 1)
-            clamped_backoff = min(backoff, self.requeue_max_backoff)
+            # The jitter is applied after clamping so that retries for services that have
+            # reached the maximum backoff do not all fire at the same time
+            # The jitter only ever shortens the delay so that the maximum is respected
+            clamped_backoff = min(2**retries, self.requeue_max_backoff)
+            backoff = clamped_backoff * random.uniform(0.5, 1.0)
             # Schedule the requeue for the future and stash the handle
             loop = asyncio.get_running_loop()
             self._handles[event.service.name] = loop.call_later(
-                clamped_backoff,
+                backoff,
                 self._do_requeue,
                 event,
                 retries + 1
@@ -262,9 +265,12 @@ class Processor:
         initial_services, events = await store.watch()
         # Enqueue the events required to bring the observed state to the initial desired state
         known_services = await self.known_services()
+        # The names of the initial services are collected in the same pass as enqueuing them
+        initial_names = set()
         for service in initial_services:
             queue.enqueue(model.Event(model.EventKind.UPDATED, service))
-        for name in known_services.difference(s.name for s in initial_services):
+            initial_names.add(service.name)
+        for name in known_services - initial_names:
             queue.enqueue(model.Event(model.EventKind.DELETED, model.Service(name)))
         self.logger.info("Launching with %d worker processes", self.worker_count)
         # Set up the producer and consumer tasks
@@ -1,7 +1,7 @@
 import asyncio
 import base64
-import copy
 import dataclasses
+import hashlib
 import json
 import logging
 import os
@@ -9,7 +9,7 @@ import typing
 
 from easykube import Configuration, ApiError
 
-from pyhelm3 import Client as HelmClient
+from pyhelm3 import Client as HelmClient, ReleaseNotFoundError, ReleaseRevisionStatus
 
 from .. import config, metrics, model, store, util
 
@@ -29,6 +29,42 @@ class ServiceHelmStatus(metrics.Metric):
         }
 
 
+class WatchExpired(Exception):
+    """
+    Raised when the API server reports an error on a watch, e.g. 410 Gone when the
+    resource version that the watch is resuming from is too old.
+    """
+    def __init__(self, status):
+        self.status = status
+        super().__init__(f"{status.get('code')} {status.get('reason')}")
+
+
+def _raise_on_watch_error(events):
+    """
+    Modifies the given watch events so that ERROR events raise WatchExpired.
+
+    The API server reports an expired watch as an ERROR event containing a Status
+    rather than an error response, which easykube cannot process as it has no resource
+    version. This function makes sure that such events reach us as an exception that
+    will not cause easykube to resume the watch.
+    """
+    process_chunk = events._process_chunk
+
+    def _process_chunk(chunk):
+        try:
+            event = process_chunk(chunk)
+        except KeyError:
+            event = json.loads(chunk)
+            if event.get("type") != "ERROR":
+                raise
+        if event["type"] == "ERROR":
+            raise WatchExpired(event.get("object") or {})
+        return event
+
+    events._process_chunk = _process_chunk
+    return events
+
+
 class Processor(base.Processor):
     """
     Reconciles services by using a Helm chart to create resources in Kubernetes.
@@ -47,6 +83,10 @@ class Processor(base.Processor):
             insecure_skip_tls_verify = config.helm_client.insecure_skip_tls_verify,
             unpack_directory = config.helm_client.unpack_directory
         )
+        # The trust values only depend on the configuration, so they are built once
+        self._trust_values = self._get_trust_values()
+        # The checksums of the chart and values for the last successful release of each service
+        self._release_checksums: typing.Dict[str, str] = {}
         super().__init__(
             logging.getLogger(__name__),
             config.reconciliation_max_concurrency,
@@ -58,6 +98,9 @@ class Processor(base.Processor):
         Perform any startup tasks that are required.
         """
         await self.ekclient.__aenter__()
+        # Resolve the resources that we use once, rather than for every reconciliation
+        self._secrets = await self.ekclient.api("v1").resource("secrets")
+        self._configmaps = await self.ekclient.api("v1").resource("configmaps")
 
     async def shutdown(self):
         """
@@ -84,9 +127,8 @@ class Processor(base.Processor):
                 service.config.get("auth-oidc-allowed-groups", []),
             )
         # Otherwise, we need to wait for the discovery secret to become available
-        secrets = await self.ekclient.api("v1").resource("secrets")
         try:
-            secret = await secrets.fetch(
+            secret = await self._secrets.fetch(
                 self.config.ingress.oidc.discovery_secret_name_template.format(
                     service_name = service.name
                 )
@@ -96,28 +138,31 @@ class Processor(base.Processor):
                 raise base.RetryRequired("oidc discovery secret not available")
             else:
                 raise
-        secret_data = {
-            key: base64.b64decode(value).decode()
-            for key, value in secret.get("data", {}).items()
-        }
-        allowed_groups_json = secret_data.get("allowed-groups")
+        # Only decode the keys that we actually use
+        secret_data = secret.get("data", {})
+        allowed_groups_b64 = secret_data.get("allowed-groups")
         return (
-            secret_data["issuer-url"],
-            secret_data["client-id"],
-            secret_data["client-secret"],
-            json.loads(allowed_groups_json) if allowed_groups_json else [],
+            base64.b64decode(secret_data["issuer-url"]).decode(),
+            base64.b64decode(secret_data["client-id"]).decode(),
+            base64.b64decode(secret_data["client-secret"]).decode(),
+            json.loads(base64.b64decode(allowed_groups_b64)) if allowed_groups_b64 else [],
         )
 
-    async def _reconcile_oidc_cookie_secret(self, service: model.Service) -> str:
+    def _oidc_cookie_secret_name(self, service: model.Service) -> str:
         """
-        Returns the cookie secret for the OAuth2 proxy for the service.
+        Returns the name of the secret containing the OAuth2 proxy cookie secret for the service.
         """
-        secrets = await self.ekclient.api("v1").resource("secrets")
-        secret_name = self.config.ingress.oidc.oauth2_proxy_cookie_secret_template.format(
+        return self.config.ingress.oidc.oauth2_proxy_cookie_secret_template.format(
             service_name = service.name
         )
+
+    async def _reconcile_oidc_cookie_secret(self, service: model.Service) -> str:
+        """
+        Returns the cookie secret for the OAuth2 proxy for the service.
+        """
+        secret_name = self._oidc_cookie_secret_name(service)
         try:
-            secret = await secrets.fetch(secret_name)
+            secret = await self._secrets.fetch(secret_name)
         except ApiError as exc:
             if exc.status_code == 404:
                 cookie_secret = base64.urlsafe_b64encode(os.urandom(32)).decode()
@@ -213,22 +258,24 @@ class Processor(base.Processor):
         """
         Returns the values for configuring the TLS for a service.
         """
-        tls_enabled = self.config.ingress.tls.enabled or "tls-cert" in service.config
+        tls_config = self.config.ingress.tls
+        has_tls_cert = "tls-cert" in service.config
+        tls_enabled = tls_config.enabled or has_tls_cert
         values = { "global": { "secure": tls_enabled }}
         if not tls_enabled:
             return values
         tls_values = values.setdefault("ingress", {}).setdefault("tls", {})
-        if "tls-cert" in service.config:
+        if has_tls_cert:
             tls_values["existingCertificate"] = {
                 "cert": service.config["tls-cert"],
                 "key": service.config["tls-key"],
             }
-        elif self.config.ingress.tls.terminated_at_proxy:
+        elif tls_config.terminated_at_proxy:
             tls_values["terminatedAtProxy"] = True
-        elif self.config.ingress.tls.secret_name:
-            tls_values["secretName"] = self.config.ingress.tls.secret_name
+        elif tls_config.secret_name:
+            tls_values["secretName"] = tls_config.secret_name
         else:
-            tls_values["annotations"] = self.config.ingress.tls.annotations
+            tls_values["annotations"] = tls_config.annotations
         if "tls-client-ca" in service.config:
             tls_values["clientCA"] = service.config["tls-client-ca"]
         return values
@@ -248,17 +295,20 @@ class Processor(base.Processor):
         #      containing OIDC credentials for each service
         #   4. If external auth is configured, use that
         #   5. No auth is applied
+        oidc_config = self.config.ingress.oidc
+        external_auth_config = self.config.ingress.external_auth
         values = {}
         if service.config.get("skip-auth", False):
             values["oidc"] = { "enabled": False }
             values["externalAuth"] = { "enabled": False }
         elif (
             service.config.get("auth-oidc-issuer") or
-            self.config.ingress.oidc.discovery_enabled
+            oidc_config.discovery_enabled
         ):
             issuer_url, client_id, client_secret, allowed_groups = (
                 await self._reconcile_oidc_credentials(service)
             )
+            # Only create the cookie secret once the credentials are available
             cookie_secret = await self._reconcile_oidc_cookie_secret(service)
             values["oidc"] = {
                 "enabled": True,
@@ -266,7 +316,7 @@ class Processor(base.Processor):
                     "clientID": client_id,
                     "clientSecret": client_secret,
                     "allowedGroups": allowed_groups,
-                    "loginURLParameters": self.config.ingress.oidc.forwarded_query_params,
+                    "loginURLParameters": oidc_config.forwarded_query_params,
                     "oidcConfig": {
                         "issuerURL": issuer_url,
                     },
@@ -275,7 +325,7 @@ class Processor(base.Processor):
                     "configData": {
                         "injectResponseHeaders": [
                             {"name": h, "values": [{"claim": c}]}
-                            for h, c in self.config.ingress.oidc.inject_request_headers.items()
+                            for h, c in oidc_config.inject_request_headers.items()
                         ],
                     },
                 },
@@ -283,15 +333,15 @@ class Processor(base.Processor):
                     "cookie-secret": cookie_secret,
                 },
             }
-        elif self.config.ingress.external_auth.url:
+        elif external_auth_config.url:
             values["externalAuth"] = {
                 "enabled": True,
-                "url": self.config.ingress.external_auth.url,
-                "signinUrl": self.config.ingress.external_auth.signin_url,
-                "nextUrlParam": self.config.ingress.external_auth.next_url_param,
-                "requestHeaders": self.config.ingress.external_auth.request_headers,
-                "responseHeaders": self.config.ingress.external_auth.response_headers,
-                "paramHeaderPrefix": self.config.ingress.external_auth.param_header_prefix,
+                "url": external_auth_config.url,
+                "signinUrl": external_auth_config.signin_url,
+                "nextUrlParam": external_auth_config.next_url_param,
+                "requestHeaders": external_auth_config.request_headers,
+                "responseHeaders": external_auth_config.response_headers,
+                "paramHeaderPrefix": external_auth_config.param_header_prefix,
                 "params": service.config.get("auth-external-params", {}),
             }
         return values
@@ -305,22 +355,64 @@ class Processor(base.Processor):
         return { release.name for release in releases }
 
     async def service_updated(self, service: model.Service):
-        endpoints = ", ".join(f"{ep.address}:{ep.port}" for ep in service.endpoints)
-        self.logger.info(f"Reconciling {service.name} [{endpoints}]")
-        # Install the Helm release
-        _ = await self.helm_client.ensure_release(
-            service.name,
-            await self.helm_client.get_chart(
+        # Only format the endpoints if the message will actually be emitted
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(
+                "Reconciling %s [%s]",
+                service.name,
+                ", ".join(f"{ep.address}:{ep.port}" for ep in service.endpoints)
+            )
+        # Fetching the chart and preparing the auth values are independent
+        chart, auth_values = await asyncio.gather(
+            self.helm_client.get_chart(
                 self.config.service_chart_name,
                 repo = self.config.service_chart_repo,
                 version = self.config.service_chart_version
             ),
+            self._get_auth_values(service)
+        )
+        values = [
             self.config.service_default_values,
-            self._get_trust_values(),
+            self._trust_values,
             self._get_service_values(service),
             self._get_ingress_enabled(service),
             self._get_tls_values(service),
-            await self._get_auth_values(service),
+            auth_values,
+        ]
+        # If the chart and values are the same as the last successful release for the
+        # service, there is no need to run Helm again
+        # The resolved chart is used so that a new version of an unpinned chart is rolled out
+        checksum = hashlib.sha256(
+            json.dumps(
+                [
+                    chart.ref,
+                    chart.repo,
+                    chart.metadata.name,
+                    chart.metadata.version,
+                    values,
+                ],
+                default = str,
+                sort_keys = True
+            ).encode()
+        ).hexdigest()
+        if self._release_checksums.get(service.name) == checksum:
+            # We still check the status of the release, so that a release that has failed
+            # or been removed out-of-band is repaired by ensure_release
+            try:
+                revision = await self.helm_client.get_current_revision(
+                    service.name,
+                    namespace = self.config.target_namespace
+                )
+            except ReleaseNotFoundError:
+                revision = None
+            if revision and revision.status == ReleaseRevisionStatus.DEPLOYED:
+                self.logger.info("Helm release for %s is up to date", service.name)
+                return
+        # Install the Helm release
+        _ = await self.helm_client.ensure_release(
+            service.name,
+            chart,
+            *values,
             cleanup_on_fail = True,
             # The namespace should exist, so we don't need to create it
             create_namespace = False,
@@ -328,21 +420,21 @@ class Processor(base.Processor):
             # Wait for the components to become ready
             wait = True
         )
+        self._release_checksums[service.name] = checksum
 
     async def service_removed(self, service: model.Service):
-        self.logger.info(f"Removing {service.name}")
-        # Remove the Helm release for the service
-        await self.helm_client.uninstall_release(
-            service.name,
-            namespace = self.config.target_namespace,
-            wait = True
-        )
-        # Delete the OIDC cookie secret if required
-        secrets = await self.ekclient.api("v1").resource("secrets")
-        secret_name = self.config.ingress.oidc.oauth2_proxy_cookie_secret_template.format(
-            service_name = service.name
+        self.logger.info("Removing %s", service.name)
+        self._release_checksums.pop(service.name, None)
+        # Remove the Helm release and delete the OIDC cookie secret, if present
+        # These are independent, so they are done concurrently
+        await asyncio.gather(
+            self.helm_client.uninstall_release(
+                service.name,
+                namespace = self.config.target_namespace,
+                wait = True
+            ),
+            self._secrets.delete(self._oidc_cookie_secret_name(service))
         )
-        await secrets.delete(secret_name)
 
     async def metrics(self) -> typing.Iterable[metrics.Metric]:
         # Drop down to the Helm command to get statuses without extra Helm commands
@@ -360,25 +452,83 @@ class Processor(base.Processor):
         """
         Yields watch events for the specified object, including a synthetic add/delete event
         for the initial state.
+
+        The watch is resumed from the last seen resource version by easykube when the stream
+        is closed, but if that version has expired the object is re-listed and the watch
+        is restarted from the new initial state.
         """
-        initial_state, events = await ekresource.watch_one(name, namespace = namespace)
-        if initial_state:
-            yield {
-                "type": "ADDED",
-                "object": initial_state
-            }
-        else:
-            yield {
-                "type": "DELETED",
-                "object": {
-                    "metadata": {
-                        "name": name,
-                        "namespace": namespace,
-                    },
+        while True:
+            initial_state, events = await ekresource.watch_one(name, namespace = namespace)
+            if initial_state:
+                yield {
+                    "type": "ADDED",
+                    "object": initial_state
                 }
-            }
-        async for event in events:
-            yield event
+            else:
+                yield {
+                    "type": "DELETED",
+                    "object": {
+                        "metadata": {
+                            "name": name,
+                            "namespace": namespace,
+                        },
+                    }
+                }
+            try:
+                async for event in self._coalesce_events(_raise_on_watch_error(events)):
+                    yield event
+            except (ApiError, WatchExpired) as exc:
+                # An expired watch usually arrives as an ERROR event on the stream, but
+                # the API server can also reject the request to resume the watch
+                if isinstance(exc, ApiError) and exc.status_code != 410:
+                    raise
+                self.logger.warning(
+                    "Watch failed (%s), restarting [apiVersion: %s, kind: %s, name: %s, ns: %s]",
+                    exc,
+                    ekresource.api_version,
+                    ekresource.kind,
+                    name,
+                    namespace
+                )
+            else:
+                return
+
+    async def _coalesce_events(self, events):
+        """
+        Yields events from the given iterator, coalescing bursts of events so that only
+        the most recent event in each burst is yielded.
+        """
+        queue = asyncio.Queue()
+
+        async def produce():
+            # Once the events are exhausted, put either the exception or None on the queue
+            try:
+                async for event in events:
+                    queue.put_nowait(event)
+            except Exception as exc:
+                queue.put_nowait(exc)
+            else:
+                queue.put_nowait(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                batch = [await queue.get()]
+                # Give the rest of the burst a chance to arrive before draining the queue
+                await asyncio.sleep(self.config.mirror_coalesce_interval)
+                while not queue.empty():
+                    batch.append(queue.get_nowait())
+                # Anything that is not an event is always the last item from the producer
+                finished = not isinstance(batch[-1], dict)
+                outcome = batch.pop() if finished else None
+                if batch:
+                    yield batch[-1]
+                if isinstance(outcome, Exception):
+                    raise outcome
+                elif finished:
+                    return
+        finally:
+            producer.cancel()
 
     async def _mirror_obj(self, ekresource, name, source_namespace, target_namespace):
         """
@@ -392,22 +542,30 @@ class Processor(base.Processor):
             source_namespace,
             target_namespace
         )
+        # The metadata for the mirror is the same for every event, so build it once
+        mirror_metadata = {
+            "name": name,
+            # Set the namespace to the target namespace
+            "namespace": target_namespace,
+            "labels": { self.config.created_by_label: "zenith-sync" },
+            "annotations": { self.config.mirror_annotation: f"{source_namespace}/{name}" },
+        }
+        # Digest of the last object that was applied, used to skip no-op applies
+        last_digest = None
         async for event in self._watch_events(ekresource, name, source_namespace):
             # Prepare the mirror object from the source object
-            mirror_obj = copy.deepcopy(event["object"])
-            # Make sure that the API version and kind are present
-            mirror_obj.setdefault("apiVersion", ekresource.api_version)
-            mirror_obj.setdefault("kind", ekresource.kind)
-            # Replace the metadata object with one containing only what we need
-            mirror_obj["metadata"] = {
-                "name": mirror_obj["metadata"]["name"],
-                # Set the namespace to the target namespace
-                "namespace": target_namespace,
-                "labels": { self.config.created_by_label: "zenith-sync" },
-                "annotations": { self.config.mirror_annotation: f"{source_namespace}/{name}" },
+            # A shallow copy is sufficient as we replace the metadata and do not modify the rest
+            mirror_obj = {
+                # Make sure that the API version and kind are present
+                "apiVersion": ekresource.api_version,
+                "kind": ekresource.kind,
+                **event["object"],
+                # Replace the metadata object with one containing only what we need
+                "metadata": mirror_metadata,
             }
 
             if event["type"] == "DELETED":
+                last_digest = None
                 self.logger.info(
                     "Deleting mirrored object [apiVersion: %s, kind: %s, name: %s, ns: %s]",
                     ekresource.api_version,
@@ -420,6 +578,13 @@ class Processor(base.Processor):
                     namespace = mirror_obj["metadata"]["namespace"]
                 )
             else:
+                # Events that do not change the mirrored content, e.g. metadata-only updates
+                # to the source object, do not require the mirror to be re-applied
+                digest = hashlib.sha256(
+                    json.dumps(mirror_obj, sort_keys = True).encode()
+                ).hexdigest()
+                if digest == last_digest:
+                    continue
                 self.logger.info(
                     "Updating mirrored object [apiVersion: %s, kind: %s, name: %s, ns: %s]",
                     ekresource.api_version,
@@ -433,55 +598,45 @@ class Processor(base.Processor):
                     namespace = mirror_obj["metadata"]["namespace"],
                     force = True
                 )
+                last_digest = digest
 
     async def _run_trust_bundle_mirror(self):
         """
         Continuously mirrors the trust bundle into the target namespace.
         """
-        # We need to mirror TLS secrets alongside handling events
-        if self.config.trust_bundle_configmap_name:
-            configmaps = await self.ekclient.api("v1").resource("configmaps")
-            await self._mirror_obj(
-                configmaps,
-                self.config.trust_bundle_configmap_name,
-                self.config.self_namespace,
-                self.config.target_namespace
-            )
-        else:
-            self.logger.info("Mirroring of trust bundle configmap is not required")
-            while True:
-                await asyncio.Event().wait()
+        await self._mirror_obj(
+            self._configmaps,
+            self.config.trust_bundle_configmap_name,
+            self.config.self_namespace,
+            self.config.target_namespace
+        )
 
     async def _run_tls_mirror(self):
         """
         Continuously mirrors the TLS secret into the target namespace.
         """
-        # We need to mirror TLS secrets alongside handling events
+        await self._mirror_obj(
+            self._secrets,
+            self.config.ingress.tls.secret_name,
+            self.config.self_namespace,
+            self.config.target_namespace
+        )
+
+    async def run(self, store: store.Store):
+        # We need to run the mirrors alongside the main loop
+        # Tasks are only created for the mirrors that are required
+        tasks = [asyncio.create_task(super().run(store))]
+        if self.config.trust_bundle_configmap_name:
+            tasks.append(asyncio.create_task(self._run_trust_bundle_mirror()))
+        else:
+            self.logger.info("Mirroring of trust bundle configmap is not required")
         if self.config.ingress.tls.enabled and self.config.ingress.tls.secret_name:
-            secrets = await self.ekclient.api("v1").resource("secrets")
-            await self._mirror_obj(
-                secrets,
-                self.config.ingress.tls.secret_name,
-                self.config.self_namespace,
-                self.config.target_namespace
-            )
+            tasks.append(asyncio.create_task(self._run_tls_mirror()))
         else:
             self.logger.info("Mirroring of wildcard TLS secret is not required")
-            while True:
-                await asyncio.Event().wait()
-
-    async def run(self, store: store.Store):
-        # We need to run the TLS mirror alongside the main loop
-        done, not_done = await asyncio.wait(
-            [
-                asyncio.create_task(super().run(store)),
-                asyncio.create_task(self._run_trust_bundle_mirror()),
-                asyncio.create_task(self._run_tls_mirror()),
-            ],
-            return_when = asyncio.FIRST_COMPLETED
-        )
+        done, not_done = await asyncio.wait(tasks, return_when = asyncio.FIRST_COMPLETED)
         # Any exceptions are not raised until the result is requested
-        # We also cancel the other task
+        # We also cancel the other tasks
         for task in not_done:
             await util.task_cancel_and_wait(task)
         for task in done: